@@ -0,0 +1,302 @@
+"""
+Chunked, process-parallel gdalwarp.
+
+The destination grid is split into tiles that are warped independently by a pool of worker
+processes, each with its own memory limit, and the tiles are then streamed into a single
+Cloud Optimized GeoTIFF (COG), or referenced by a VRT destination file (*.vrt only, as the VRT
+depends on the tiles being kept).
+
+Tiles are written to a <dstfile>.chunks directory, and a tile is only renamed to its final name
+once it has been completely warped, so a failed run may be resumed by running the same command
+again: completed tiles are skipped and only the missing ones are warped. Tiles are only reused
+if the manifest shows they were warped from the same source file version and options, and
+overwrite only applies to an existing destination file.
+
+Used by the GdalWarp service when any of its chunking inputs is specified, e.g.:
+
+    python chunked_warp.py src.tif dst.tif --tr 20 20 --chunk-size 4096 --workers 8 --wm 512
+"""
+from __future__ import division
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+from osgeo import gdal
+
+__author__ = "Derek O'Callaghan"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4096
+# Memory budget per worker in MB, split between the GDAL block cache and the warp buffer
+DEFAULT_WORKER_MEMORY_MB = 256
+DEFAULT_RETRIES = 2
+# Interval between checks for completed workers, in seconds
+POLL_INTERVAL = 0.5
+OUTPUT_FORMATS = ['COG', 'VRT']
+
+MANIFEST_FILE = 'manifest.json'
+TILE_CREATION_OPTIONS = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
+
+def destination_grid(srcfile, tr=None):
+    """
+    Get the gdalwarp destination grid without warping any data.
+
+    Returns
+    -------
+    dict
+        Raster size, geotransform and projection of the destination grid.
+    """
+    options = {'format': 'VRT'}
+    if tr:
+        options['xRes'], options['yRes'] = tr
+    vrt = gdal.Warp('', srcfile, **options)
+    return {
+        'xsize': vrt.RasterXSize,
+        'ysize': vrt.RasterYSize,
+        'geotransform': list(vrt.GetGeoTransform()),
+        'projection': vrt.GetProjection(),
+    }
+
+
+def tiles(grid, chunk_size):
+    """Generate (name, xoff, yoff, xsize, ysize) tiles covering the destination grid."""
+    for yoff in range(0, grid['ysize'], chunk_size):
+        for xoff in range(0, grid['xsize'], chunk_size):
+            yield ('tile_%d_%d.tif' % (yoff // chunk_size, xoff // chunk_size),
+                   xoff, yoff,
+                   min(chunk_size, grid['xsize'] - xoff),
+                   min(chunk_size, grid['ysize'] - yoff))
+
+
+def merge_creation_options(creation_options, defaults):
+    """
+    Add the defaults for any creation option that is not specified, as GDAL uses the first
+    occurrence of an option.
+    """
+    names = set(option.split('=', 1)[0].upper() for option in creation_options)
+    return creation_options + [option for option in defaults if option.split('=', 1)[0].upper() not in names]
+
+
+def warp_tile(srcfile, chunks_dir, grid, tile, worker_memory, creation_options):
+    """
+    Warp a single tile, in its own worker process.
+
+    The worker memory budget is split between the GDAL block cache and the warp buffer.
+    """
+    name, xoff, yoff, xsize, ysize = tile
+    gt = grid['geotransform']
+    tmp_path = os.path.join(chunks_dir, name + '.tmp')
+    cache_memory = max(1, worker_memory // 2)
+    try:
+        gdal.UseExceptions()
+        gdal.SetCacheMax(cache_memory * 1024 * 1024)
+        gdal.Warp(tmp_path, srcfile,
+                  format='GTiff',
+                  dstSRS=grid['projection'],
+                  outputBounds=(gt[0] + xoff * gt[1],
+                                gt[3] + (yoff + ysize) * gt[5],
+                                gt[0] + (xoff + xsize) * gt[1],
+                                gt[3] + yoff * gt[5]),
+                  width=xsize,
+                  height=ysize,
+                  warpMemoryLimit=max(1, worker_memory - cache_memory),
+                  creationOptions=merge_creation_options(creation_options, TILE_CREATION_OPTIONS))
+        os.rename(tmp_path, os.path.join(chunks_dir, name))
+    except Exception:
+        logger.exception('Tile %s failed', name)
+        sys.exit(1)
+
+
+def run_tiles(tasks, workers):
+    """
+    Warp tiles in new worker processes, at most workers at a time.
+
+    Each tile is warped in its own process, so that a worker that is killed, e.g. by the OOM
+    killer, is detected from its exit code and the tile may be retried.
+
+    Yields
+    ------
+    tuple
+        (tile name, error message or None), as each tile completes.
+    """
+    pending = list(tasks)
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                task = pending.pop(0)
+                process = multiprocessing.Process(target=warp_tile, args=task)
+                process.start()
+                running[task[3][0]] = process
+            time.sleep(POLL_INTERVAL)
+            for name, process in list(running.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del running[name]
+                if process.exitcode == 0:
+                    yield name, None
+                elif process.exitcode < 0:
+                    yield name, 'worker killed by signal %d' % -process.exitcode
+                else:
+                    yield name, 'worker exited with code %d' % process.exitcode
+    finally:
+        for process in running.values():
+            process.terminate()
+            process.join()
+
+
+def write_status(progress, message):
+    """Report progress in the service status file, if any: <percentage> <message>"""
+    status_file = os.environ.get('STATUS_FILE')
+    if status_file:
+        with open(status_file, 'w') as sf:
+            sf.write('%d %s\n' % (progress, message))
+
+
+def source_signature(srcfile):
+    """
+    Identify the source file and its version in the manifest.
+
+    Any source accepted by gdalwarp is supported, e.g. /vsis3/ paths, or subdataset names such as
+    NETCDF:file.nc:var, for which the size and mtime are None as they cannot be stat'ed.
+    """
+    stat = gdal.VSIStatL(srcfile)
+    return {
+        'srcfile': os.path.abspath(srcfile) if os.path.exists(srcfile) else srcfile,
+        'src_size': stat.size if stat else None,
+        'src_mtime': stat.mtime if stat else None,
+    }
+
+
+def prepare_chunks_dir(chunks_dir, manifest):
+    """
+    Create the tile directory, or reuse an existing one if it belongs to the same warp, so that
+    the warp is resumed. Tiles from a different warp or source file version are removed.
+    """
+    manifest_path = os.path.join(chunks_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as mf:
+            previous = json.load(mf)
+        if previous == manifest:
+            logger.info('Resuming warp from %s', chunks_dir)
+            return
+        logger.info('Removing tiles from a different warp or source file in %s', chunks_dir)
+    if os.path.isdir(chunks_dir):
+        shutil.rmtree(chunks_dir)
+
+    os.makedirs(chunks_dir)
+    with open(manifest_path, 'w') as mf:
+        json.dump(manifest, mf)
+
+
+def chunked_warp(srcfile, dstfile, tr=None, creation_options=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 workers=None, worker_memory=DEFAULT_WORKER_MEMORY_MB, output_format='COG',
+                 overwrite=False, retries=DEFAULT_RETRIES):
+    """
+    Warp srcfile to dstfile in tiles of chunk_size pixels, using a pool of worker processes.
+
+    Raises
+    ------
+    RuntimeError
+        If any tile still fails after the specified number of retries. Completed tiles are kept,
+        so that the warp may be resumed.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Output format must be one of %s, %s was specified' % (OUTPUT_FORMATS, output_format))
+    if output_format == 'VRT' and not dstfile.lower().endswith('.vrt'):
+        raise ValueError('VRT output requires a .vrt destination file, %s was specified' % dstfile)
+    # Checked before warping, rather than failing at the final step after all tiles are warped
+    if output_format == 'COG' and gdal.GetDriverByName('COG') is None:
+        raise ValueError('COG output requires the GDAL COG driver (GDAL 3.1 or later), '
+                         'use VRT output with a .vrt destination file instead')
+    if os.path.exists(dstfile):
+        if not overwrite:
+            raise ValueError('%s already exists, use overwrite to replace it' % dstfile)
+        os.remove(dstfile)
+
+    creation_options = creation_options or []
+    grid = destination_grid(srcfile, tr)
+    chunks_dir = dstfile + '.chunks'
+    prepare_chunks_dir(chunks_dir,
+                       dict(source_signature(srcfile), grid=grid, chunk_size=chunk_size,
+                            creation_options=creation_options))
+
+    all_tiles = list(tiles(grid, chunk_size))
+    pending = [tile for tile in all_tiles if not os.path.exists(os.path.join(chunks_dir, tile[0]))]
+    workers = workers or multiprocessing.cpu_count()
+    logger.info('Warping %d/%d tiles of %d pixels (%dx%d) with %d workers',
+                len(pending), len(all_tiles), chunk_size, grid['xsize'], grid['ysize'], workers)
+
+    done = len(all_tiles) - len(pending)
+    for attempt in range(retries + 1):
+        failed = []
+        tasks = [(srcfile, chunks_dir, grid, tile, worker_memory, creation_options) for tile in pending]
+        for name, error in run_tiles(tasks, workers):
+            if error:
+                logger.warning('Tile %s failed (attempt %d): %s', name, attempt + 1, error)
+                tmp_path = os.path.join(chunks_dir, name + '.tmp')
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                failed.append(name)
+            else:
+                done += 1
+                write_status(done * 90 // len(all_tiles), 'Warped %d/%d tiles' % (done, len(all_tiles)))
+        pending = [tile for tile in pending if tile[0] in failed]
+        if not pending:
+            break
+
+    if pending:
+        raise RuntimeError('%d tiles failed, run again to resume: %s' % (len(pending), [tile[0] for tile in pending]))
+
+    tile_paths = [os.path.join(chunks_dir, tile[0]) for tile in all_tiles]
+    if output_format == 'VRT':
+        # The VRT references the tiles, which are kept
+        gdal.BuildVRT(dstfile, tile_paths)
+    else:
+        vrt_path = os.path.join(chunks_dir, 'mosaic.vrt')
+        gdal.BuildVRT(vrt_path, tile_paths)
+        write_status(90, 'Writing %s' % dstfile)
+        gdal.Translate(dstfile, vrt_path, format='COG', creationOptions=creation_options)
+        shutil.rmtree(chunks_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunked, process-parallel gdalwarp')
+    parser.add_argument('srcfile')
+    parser.add_argument('dstfile')
+    parser.add_argument('--tr', nargs=2, type=float, metavar=('XRES', 'YRES'),
+                        help='Output file resolution')
+    parser.add_argument('--co', action='append', default=[], metavar='NAME=VALUE',
+                        help='Creation option for the tiles and output file')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Tile edge length in destination pixels (default=%d)' % DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default=number of CPUs)')
+    parser.add_argument('--wm', type=int, default=DEFAULT_WORKER_MEMORY_MB,
+                        help='Memory limit per worker in MB, split between the block cache and warp buffer '
+                             '(default=%d)' % DEFAULT_WORKER_MEMORY_MB)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='COG',
+                        help='Output format, VRT requires a .vrt destination file (default=COG)')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Number of retries for failed tiles (default=%d)' % DEFAULT_RETRIES)
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite the target dataset if it already exists')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    gdal.UseExceptions()
+
+    chunked_warp(args.srcfile, args.dstfile, tr=args.tr, creation_options=args.co, chunk_size=args.chunk_size,
+                 workers=args.workers, worker_memory=args.wm, output_format=args.format,
+                 overwrite=args.overwrite, retries=args.retries)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,11 +9,17 @@ from pywps import LiteralInput, LiteralOutput, UOM
 from pywps.app import EO4AProcess
 from pywps.app.Common import Metadata
 
+from worker.client import worker_command, worker_socket
+
 
 __author__ = "Derek O'Callaghan"
 
 logger = logging.getLogger('PYWPS')
 
+# Any of these GdalWarp inputs enables chunked mode
+CHUNKED_WARP_INPUTS = ['chunk_size', 'workers', 'chunk_format']
+CHUNKED_WARP_FORMATS = ['COG', 'VRT']
+
 class GdalInfo(EO4AProcess):
     """
     gdalinfo service
@@ -238,6 +244,13 @@ class GdalInfo(EO4AProcess):
         logger.info('Request inputs: %s', request.inputs)
 
         # Capture gdalinfo output in a temp file
+        if worker_socket():
+            return '%s > %s' % (worker_command('gdalinfo',
+                                               datasetname=self._get_input(request, 'datasetname'),
+                                               options='%s %s' % (self._boolean_params_str(request),
+                                                                  self._optional_params_str(request))),
+                                self.temp_path)
+
         return 'gdalinfo %s %s %s > %s' % (self._boolean_params_str(request),
                                            self._optional_params_str(request),
                                            self._get_input(request, 'datasetname'),
@@ -316,6 +329,53 @@ class GdalWarp(EO4AProcess):
                 min_occurs=0,
                 max_occurs=1,
             ),                  
+            LiteralInput(
+                'wm',
+                'Memory for caching in MB',
+                data_type='integer',
+                abstract="""
+                Set the amount of memory (in megabytes) that the warp API is allowed to use for caching. 
+                In chunked mode, this is the memory limit for each worker process, split between the GDAL block cache and the warp buffer.
+                """,
+                min_occurs=0,
+                max_occurs=1,
+            ),                  
+            LiteralInput(
+                'chunk_size',
+                'Chunk size in pixels',
+                data_type='integer',
+                abstract="""
+                Enables chunked mode, where the destination grid is split into square tiles of this size (in destination pixels), 
+                which are warped in parallel by worker processes. A failed chunked warp may be resumed by executing it again 
+                with the same inputs (including overwrite), as completed tiles are kept in a <dstfile>.chunks directory, 
+                and are only reused if the source file has not changed.
+                """,
+                min_occurs=0,
+                max_occurs=1,
+            ),                  
+            LiteralInput(
+                'workers',
+                'Number of worker processes',
+                data_type='integer',
+                abstract="""
+                Number of worker processes used in chunked mode (default = number of CPUs). Enables chunked mode.
+                """,
+                min_occurs=0,
+                max_occurs=1,
+            ),                  
+            LiteralInput(
+                'chunk_format',
+                'Chunked output format, one of [COG, VRT], default = COG.',
+                data_type='string',
+                abstract="""
+                Output format used in chunked mode. COG writes the tiles into a single Cloud Optimized GeoTIFF (requires GDAL 3.1 or later), 
+                and then removes them. VRT references the warped tiles, which are kept alongside the destination file, 
+                and requires a .vrt destination file. 
+                Enables chunked mode.
+                """,
+                min_occurs=0,
+                max_occurs=1,
+            ),                  
         ]
         outputs = [
             LiteralOutput(
@@ -353,6 +413,16 @@ class GdalWarp(EO4AProcess):
         """
         logger.info('Request inputs: %s', request.inputs)
 
+        if any(name in request.inputs for name in CHUNKED_WARP_INPUTS):
+            return self._chunked_command(request)
+
+        if worker_socket():
+            return worker_command('gdalwarp',
+                                  srcfile=self._get_input(request, 'srcfile'),
+                                  dstfile=self._get_input(request, 'dstfile'),
+                                  options='%s %s' % (self._boolean_params_str(request),
+                                                     self._optional_params_str(request)))
+
         return 'gdalwarp %s %s %s %s' % (self._boolean_params_str(request),
                                          self._optional_params_str(request),
                                          self._get_input(request, 'srcfile'),
@@ -360,6 +430,36 @@ class GdalWarp(EO4AProcess):
                                         )
 
 
+    def _chunked_command(self, request):
+        """The chunked_warp.py command, used instead of gdalwarp when any chunking input is specified."""
+        params = []
+        if self._get_input(request, 'tr', default=None):
+            params.append('--tr %s' % self._get_input(request, 'tr'))
+        if self._get_input(request, 'co', default=None):
+            params.append('--co %s' % self._get_input(request, 'co'))
+        for name in ['chunk_size', 'workers', 'wm']:
+            value = self._get_input(request, name, default=None)
+            if value:
+                params.append('--%s %d' % (name.replace('_', '-'), int(value)))
+        chunk_format = self._get_input(request, 'chunk_format', default=None)
+        if chunk_format:
+            chunk_format = str(chunk_format).upper().strip()
+            if chunk_format not in CHUNKED_WARP_FORMATS:
+                raise ValueError('Chunk format must be one of %s, %s was specified' % (CHUNKED_WARP_FORMATS, chunk_format))
+            if chunk_format == 'VRT' and not self._get_input(request, 'dstfile').lower().endswith('.vrt'):
+                raise ValueError('VRT chunk format requires a .vrt destination file, %s was specified'
+                                 % self._get_input(request, 'dstfile'))
+            params.append('--format %s' % chunk_format)
+        if self._get_input(request, 'overwrite', default=False):
+            params.append('--overwrite')
+
+        return 'python %s/chunked_warp.py %s %s %s' % (self._package_path,
+                                                       ' '.join(params),
+                                                       self._get_input(request, 'srcfile'),
+                                                       self._get_input(request, 'dstfile'),
+                                                       )
+
+
     def set_output(self, request, response):
         """Set the output from the WPS request."""
         # For now, the user specifies the dstfile as an input, and it is set as an output, 
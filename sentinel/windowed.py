@@ -0,0 +1,175 @@
+"""
+Window-based processing of Sentinel-2 band rasters.
+
+Band rasters are read, combined and written one window at a time, so that peak memory depends
+on the window size rather than on the raster size or output resolution. Bands whose native
+resolution differs from the requested resolution (e.g. B08 at 10m for a 60m product, or B8A at
+20m for a 10m product) are resampled on the fly for each window.
+
+Used by the sentinel2ndvi and sentinel2rgb service scripts, e.g.:
+
+    python windowed.py ndvi 10 ndvi.tif B08.jp2 B04.jp2
+    python windowed.py rgb 10 rgb.tif B04.jp2 B03.jp2 B02.jp2
+"""
+from __future__ import division
+
+import argparse
+import logging
+
+import numpy as np
+from osgeo import gdal
+
+__author__ = "Derek O'Callaghan"
+
+logger = logging.getLogger(__name__)
+
+# Window edge length in pixels, a multiple of the output GeoTIFF tile size
+DEFAULT_BLOCK_SIZE = 1024
+# Upper bound for the GDAL block cache, in MB
+DEFAULT_CACHE_MB = 256
+
+OUTPUT_CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
+
+def target_grid(dataset, resolution):
+    """
+    Get the output grid covering the extent of a dataset at the specified resolution.
+
+    Returns
+    -------
+    tuple
+        (xsize, ysize, geotransform) of the output grid.
+    """
+    gt = dataset.GetGeoTransform()
+    xsize = int(round(dataset.RasterXSize * gt[1] / resolution))
+    ysize = int(round(dataset.RasterYSize * abs(gt[5]) / resolution))
+    return xsize, ysize, (gt[0], resolution, 0.0, gt[3], 0.0, -resolution)
+
+
+def windows(xsize, ysize, block_size=DEFAULT_BLOCK_SIZE):
+    """Generate (xoff, yoff, xsize, ysize) windows covering a grid, row by row."""
+    for yoff in range(0, ysize, block_size):
+        win_ysize = min(block_size, ysize - yoff)
+        for xoff in range(0, xsize, block_size):
+            yield xoff, yoff, min(block_size, xsize - xoff), win_ysize
+
+
+def read_window(dataset, grid_gt, window, buf_type=None):
+    """
+    Read the first band of a dataset for a window of the output grid.
+
+    The source window matching the output window is computed from the geotransforms, and the
+    data are resampled to the output window size if the resolutions differ: averaging when
+    downsampling, nearest neighbour when upsampling.
+    """
+    xoff, yoff, xsize, ysize = window
+    src_gt = dataset.GetGeoTransform()
+    x_ratio = grid_gt[1] / src_gt[1]
+    y_ratio = grid_gt[5] / src_gt[5]
+
+    src_xoff = max(0.0, (grid_gt[0] + xoff * grid_gt[1] - src_gt[0]) / src_gt[1])
+    src_yoff = max(0.0, (grid_gt[3] + yoff * grid_gt[5] - src_gt[3]) / src_gt[5])
+    src_xsize = min(xsize * x_ratio, dataset.RasterXSize - src_xoff)
+    src_ysize = min(ysize * y_ratio, dataset.RasterYSize - src_yoff)
+
+    if x_ratio > 1 or y_ratio > 1:
+        resample_alg = gdal.GRIORA_Average
+    else:
+        resample_alg = gdal.GRIORA_NearestNeighbour
+
+    return dataset.GetRasterBand(1).ReadAsArray(src_xoff, src_yoff, src_xsize, src_ysize,
+                                                buf_xsize=xsize, buf_ysize=ysize,
+                                                buf_type=buf_type, resample_alg=resample_alg)
+
+
+def process(rasters, resolution, outfile, calc, num_bands, data_type,
+            creation_options=None, block_size=DEFAULT_BLOCK_SIZE, open_raster=gdal.Open):
+    """
+    Apply a calculation to a set of band rasters, window by window.
+
+    Parameters
+    ----------
+    rasters : list
+        Paths to the single band input rasters, which must cover the same extent.
+    resolution : int
+        Output resolution in metres.
+    outfile : string
+        Path to the output GeoTIFF.
+    calc : callable
+        Called with one array per input raster for each window, returning a list of num_bands arrays.
+    num_bands : int
+        Number of output bands.
+    data_type : int
+        GDAL data type of the output bands.
+    open_raster : callable
+        Opens an input raster, e.g. from a cache of open datasets.
+    """
+    datasets = []
+    for raster in rasters:
+        dataset = open_raster(raster)
+        if dataset is None:
+            raise IOError('Unable to open raster %s' % raster)
+        datasets.append(dataset)
+
+    xsize, ysize, grid_gt = target_grid(datasets[0], resolution)
+    logger.info('Processing %s at %sm (%dx%d) in %d pixel windows', rasters, resolution, xsize, ysize, block_size)
+
+    options = OUTPUT_CREATION_OPTIONS + (creation_options or [])
+    output = gdal.GetDriverByName('GTiff').Create(outfile, xsize, ysize, num_bands, data_type, options)
+    if output is None:
+        raise IOError('Unable to create raster %s' % outfile)
+    output.SetGeoTransform(grid_gt)
+    output.SetProjection(datasets[0].GetProjection())
+
+    for window in windows(xsize, ysize, block_size):
+        results = calc(*[read_window(dataset, grid_gt, window) for dataset in datasets])
+        for i, result in enumerate(results):
+            output.GetRasterBand(i + 1).WriteArray(result, window[0], window[1])
+
+    output.FlushCache()
+    output = None
+
+
+def ndvi(nir, red):
+    """NDVI = (NIR-Red)/(NIR+Red), matching the previous gdal_calc.py expression."""
+    nir = nir.astype(np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return [(nir - red) / (nir + red)]
+
+
+def rgb(red, green, blue):
+    """RGB composite, one output band per input band."""
+    return [red, green, blue]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Window-based processing of Sentinel-2 band rasters')
+    parser.add_argument('product', choices=['ndvi', 'rgb'])
+    parser.add_argument('resolution', type=int, help='Output resolution in metres')
+    parser.add_argument('outfile')
+    parser.add_argument('rasters', nargs='+')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help='Window edge length in pixels (default=%d)' % DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--cache', type=int, default=DEFAULT_CACHE_MB,
+                        help='GDAL block cache size in MB (default=%d)' % DEFAULT_CACHE_MB)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    gdal.UseExceptions()
+    gdal.SetCacheMax(args.cache * 1024 * 1024)
+
+    if args.product == 'ndvi':
+        if len(args.rasters) != 2:
+            parser.error('NDVI requires NIR and Red band rasters')
+        process(args.rasters, args.resolution, args.outfile, ndvi, 1, gdal.GDT_Float32,
+                block_size=args.block_size)
+    else:
+        if len(args.rasters) != 3:
+            parser.error('RGB requires R, G and B band rasters')
+        data_type = gdal.Open(args.rasters[0]).GetRasterBand(1).DataType
+        process(args.rasters, args.resolution, args.outfile, rgb, 3, data_type,
+                creation_options=['PHOTOMETRIC=RGB'], block_size=args.block_size)
+
+
+if __name__ == '__main__':
+    main()
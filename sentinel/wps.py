@@ -6,11 +6,13 @@ from pywps import LiteralInput, LiteralOutput, UOM
 from pywps.app import EO4AProcess
 from pywps.app.Common import Metadata
 
+from worker.client import worker_command, worker_socket
+
 __author__ = "Derek O'Callaghan"
 
 logger = logging.getLogger('PYWPS')
 
-NDVI_RESOLUTIONS = [20, 60]
+S2_RESOLUTIONS = [10, 20, 60]
 
 class Sentinel2Rgb(EO4AProcess):
     """
@@ -64,10 +66,12 @@ class Sentinel2Rgb(EO4AProcess):
             ),
             LiteralInput(
                 'resolution',
-                'Sentinel-2 product resolution (default=60)',
+                'Sentinel-2 product resolution, one of [10, 20, 60], default = 60.',
                 data_type='integer',
                 abstract="""
                 The default resolution of 60m is used for level 2 products generated by <a href="http://step.esa.int/main/third-party-plugins-2/sen2cor/" target="_blank">Sen2Cor</a>, as this generates raster layers of manageable size for the pathfinder.
+                Bands that are not available at the specified resolution are resampled from their native resolution. Rasters are processed in windows, 
+                so memory usage does not increase with resolution.
                 """,
                 default="60",
                 min_occurs=1,
@@ -108,13 +112,26 @@ class Sentinel2Rgb(EO4AProcess):
         """The service command. Do not do any processing here."""
         logger.info('Request inputs: %s', request.inputs)
 
-        return 'bash -x %s/sentinel2rgb %s %02d %02d %02d R60m %s' % (self._package_path,
+        resolution = self._get_input(request, 'resolution')
+        if resolution not in S2_RESOLUTIONS:
+            raise ValueError('Resolution must be one of %s, %s was specified' % (S2_RESOLUTIONS, resolution))
+
+        if worker_socket():
+            return worker_command('sentinel2-rgb',
+                                  s2_product_dir=self._get_input(request, 's2_product_dir'),
+                                  r_band='%02d' % int(self._get_input(request, 'r_band')),
+                                  g_band='%02d' % int(self._get_input(request, 'g_band')),
+                                  b_band='%02d' % int(self._get_input(request, 'b_band')),
+                                  resolution='R%sm' % resolution,
+                                  output_dir=self._output_dir())
+
+        return 'bash -x %s/sentinel2rgb %s %02d %02d %02d %s %s' % (self._package_path,
                                                                     self._get_input(request, 's2_product_dir'),
                                                                     # TODO: use defaults from input definitions
                                                                     int(self._get_input(request, 'r_band')),
                                                                     int(self._get_input(request, 'g_band')),
                                                                     int(self._get_input(request, 'b_band')),
-                                                                    #'R%sm' % self._get_input(request, 'resolution'),
+                                                                    'R%sm' % resolution,
                                                                     self._output_dir(),
                                                                     )
 
@@ -167,12 +184,12 @@ class Sentinel2Ndvi(EO4AProcess):
             ),
             LiteralInput(
                 'resolution',
-                'Sentinel-2 product resolution, one of [20, 60], default = 60.',
+                'Sentinel-2 product resolution, one of [10, 20, 60], default = 60.',
                 data_type='integer',
                 abstract="""
                 The default resolution of 60m is used for Sentinel-2 products, as this generates rasters of manageable size for the pathfinder.
-                Note that band 8 will be resampled from 10m if it is specified as the NIR or Red band. 10m resolution will not be supported for
-                the pathfinder, as it may require band resampling, and lead to large rasters.
+                Bands that are not available at the specified resolution are resampled from their native resolution, e.g. band 8 from 10m, 
+                or band 8A from 20m for 10m NDVI rasters. Rasters are processed in windows, so memory usage does not increase with resolution.
                 """,
                 default="60",
                 min_occurs=1,
@@ -214,8 +231,8 @@ class Sentinel2Ndvi(EO4AProcess):
         logger.info('Request inputs: %s', request.inputs)
 
         resolution = self._get_input(request, 'resolution')
-        if resolution not in NDVI_RESOLUTIONS:
-            raise ValueError('Resolution must be one of %s, %s was specified' % (NDVI_RESOLUTIONS, resolution))
+        if resolution not in S2_RESOLUTIONS:
+            raise ValueError('Resolution must be one of %s, %s was specified' % (S2_RESOLUTIONS, resolution))
 
         def get_band(band):
             band_val = str(self._get_input(request, band)).upper().strip()
@@ -223,6 +240,14 @@ class Sentinel2Ndvi(EO4AProcess):
                 band_val =  '%02d' % int(band_val)
             return band_val
 
+        if worker_socket():
+            return worker_command('sentinel2-ndvi',
+                                  s2_product_dir=self._get_input(request, 's2_product_dir'),
+                                  nir_band=get_band('nir_band'),
+                                  red_band=get_band('red_band'),
+                                  resolution='R%sm' % resolution,
+                                  output_dir=self._output_dir())
+
         return 'bash -x %s/sentinel2ndvi %s %s %s %s %s' % (self._package_path,
                                                                     self._get_input(request, 's2_product_dir'),
                                                                     # TODO: use defaults from input definitions
@@ -6,6 +6,8 @@ from pywps import LiteralInput, LiteralOutput, UOM
 from pywps.app import EO4AProcess
 from pywps.app.Common import Metadata
 
+from worker.client import worker_command, worker_socket
+
 __author__ = "Ana Juracic"
 
 logger = logging.getLogger(__name__)
@@ -70,6 +72,12 @@ class MergeShapefiles(EO4AProcess):
         """The service command. Do not do any processing here."""
         logger.info('Request inputs: %s', request.inputs)
 
+        if worker_socket():
+            return worker_command('merge_shapefiles',
+                                  input_dir=self._get_input(request, 'input_dir'),
+                                  output_dir=self._output_dir(),
+                                  filename=self._get_input(request, 'filename', default='example'))
+
         return 'bash -x %s/merge_shapefiles.sh %s %s %s' % (
             self._package_path,
             self._get_input(request, 'input_dir'),
@@ -0,0 +1,9 @@
+"""
+Persistent worker runtime for EO4A service commands.
+
+The runtime (runtime.py) keeps a pool of long-lived worker processes with GDAL drivers
+registered and a cache of open datasets. When EO4A_WORKER_SOCKET is set, service commands run
+the lightweight client (client.py), which submits the work to the runtime. Each request still
+starts a shell and a python -S client process, but no longer the GDAL tools or service scripts,
+which each import GDAL/NumPy, register drivers and reopen datasets.
+"""
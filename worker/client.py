@@ -0,0 +1,103 @@
+"""
+Client for the persistent worker runtime.
+
+Only depends on the standard library, so that it can be started with python -S without
+importing GDAL or NumPy. The task output is written to stdout, and any error to stderr with a
+non-zero exit code, as with the commands it replaces, e.g.:
+
+    python -S client.py gdalinfo '{"datasetname": "/tmp/raster.tif", "options": "-stats"}'
+"""
+import json
+import os
+import socket
+import sys
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+__author__ = "Derek O'Callaghan"
+
+WORKER_SOCKET_ENV = 'EO4A_WORKER_SOCKET'
+# Timeout for connecting to the runtime, in seconds. There is no limit on the task duration, as
+# the runtime replies with an error if the worker running the task dies.
+CONNECT_TIMEOUT = 10
+
+
+def worker_socket():
+    """The worker runtime socket path, or None if services should not use the runtime."""
+    return os.environ.get(WORKER_SOCKET_ENV)
+
+
+def worker_command(task, **args):
+    """
+    The service command that submits a task to the worker runtime.
+
+    Returns
+    -------
+    string
+        The service command to be executed.
+    """
+    client_path = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    return 'python -S %s %s %s' % (client_path, task, quote(json.dumps(args)))
+
+
+def submit(socket_path, task, args):
+    """
+    Submit a task to the worker runtime, and wait for its result.
+
+    Returns
+    -------
+    dict
+        The task output, and error message or None.
+    """
+    request = {
+        'task': task,
+        'args': args,
+        'cwd': os.getcwd(),
+        'status_file': os.environ.get('STATUS_FILE'),
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+        sock.settimeout(None)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.stderr.write('Usage: client.py task args_json\n')
+        sys.exit(2)
+
+    socket_path = worker_socket()
+    if not socket_path:
+        sys.stderr.write('%s is not set\n' % WORKER_SOCKET_ENV)
+        sys.exit(2)
+
+    try:
+        result = submit(socket_path, sys.argv[1], json.loads(sys.argv[2]))
+    except (socket.error, ValueError) as e:
+        sys.stderr.write('Worker runtime request failed: %s\n' % e)
+        sys.exit(1)
+    # Written as UTF-8 bytes, as output such as gdalinfo metadata may not be ASCII
+    if result['output']:
+        getattr(sys.stdout, 'buffer', sys.stdout).write(result['output'].encode('utf-8'))
+    if result['error']:
+        getattr(sys.stderr, 'buffer', sys.stderr).write((result['error'] + '\n').encode('utf-8'))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Persistent worker runtime for EO4A service commands.
+
+A pool of long-lived worker processes is started once, with GDAL/OGR drivers registered and
+NumPy imported, and each worker keeps an LRU cache of open datasets. Tasks submitted by the
+client over a Unix socket run in these workers, so small requests avoid starting one process
+per GDAL tool or service script (the service command still starts a shell and the client), e.g.:
+
+    EO4A_WORKER_SOCKET=/tmp/eo4a-worker.sock python runtime.py --processes 4 --cache-size 32
+"""
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import traceback
+
+try:
+    import queue
+    import socketserver
+except ImportError:
+    import Queue as queue
+    import SocketServer as socketserver
+
+from osgeo import gdal, ogr
+
+# Make the service packages importable when started as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker import tasks
+from worker.client import WORKER_SOCKET_ENV, worker_socket
+
+__author__ = "Derek O'Callaghan"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 32
+# GDAL block cache size per worker, in MB
+DEFAULT_GDAL_CACHE_MB = 256
+# Interval between checks that the worker running a task is still alive, in seconds
+POLL_INTERVAL = 0.5
+
+# Dataset cache of the current worker process, created by init_worker()
+_dataset_cache = None
+
+
+def file_signature(path):
+    """
+    Get a signature that changes whenever a file is modified, for checking cached datasets.
+
+    Local files use the nanosecond mtime (where available), size and inode, as the one second
+    mtime resolution of VSIStatL misses rewrites by consecutive small tasks. /vsizip/ paths use
+    the signature of the local archive.
+    """
+    if path.startswith('/vsizip/') and '.zip' in path:
+        path = path[len('/vsizip/'):path.index('.zip') + len('.zip')]
+    elif path.startswith('/vsi'):
+        stat = gdal.VSIStatL(path)
+        return (stat.mtime, stat.size) if stat else None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size, stat.st_ino
+
+
+class DatasetCache(object):
+    """
+    LRU cache of open GDAL datasets, keyed by path, open flags and open options.
+
+    A cached dataset is reopened if its file signature shows that the file has been modified
+    since it was opened, e.g. by a task in another worker, and the least recently used dataset is
+    closed when the cache is full. Tasks write files within writing(), which closes this worker's
+    cached datasets for them.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._datasets = collections.OrderedDict()
+
+    def open(self, path, flags=gdal.OF_RASTER, open_options=None):
+        """Get an open, read-only dataset for a path, opening it if it is not cached."""
+        open_options = list(open_options or [])
+        key = (path, flags, tuple(open_options))
+        signature = file_signature(path)
+
+        if key in self._datasets:
+            dataset, cached_signature = self._datasets.pop(key)
+            if cached_signature == signature:
+                self._datasets[key] = (dataset, signature)
+                return dataset
+            dataset = None
+
+        dataset = gdal.OpenEx(path, flags | gdal.OF_READONLY, open_options=open_options)
+        if dataset is None:
+            raise IOError('Unable to open dataset %s' % path)
+        self._datasets[key] = (dataset, signature)
+        while len(self._datasets) > self.maxsize:
+            self._datasets.popitem(last=False)
+        return dataset
+
+    def invalidate(self, path):
+        """Close any cached dataset for a path in this worker."""
+        for key in [key for key in self._datasets if key[0] == path]:
+            del self._datasets[key]
+
+    @contextlib.contextmanager
+    def writing(self, *paths):
+        """Context for a task writing to paths, which are not kept open by this worker."""
+        for path in paths:
+            self.invalidate(path)
+        try:
+            yield
+        finally:
+            for path in paths:
+                self.invalidate(path)
+
+    def clear(self):
+        self._datasets.clear()
+
+
+def init_worker(cache_size, gdal_cache_mb):
+    """Worker process initializer: register drivers and create the dataset cache."""
+    global _dataset_cache
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+    gdal.AllRegister()
+    ogr.RegisterAll()
+    gdal.SetCacheMax(gdal_cache_mb * 1024 * 1024)
+    # Import NumPy and the GDAL array bindings once, rather than per task
+    from osgeo import gdal_array  # noqa: F401
+    _dataset_cache = DatasetCache(cache_size)
+
+
+def run_task(task, args, cwd, status_file):
+    """
+    Run a task in a worker process.
+
+    Returns
+    -------
+    dict
+        The task output, and error message or None.
+    """
+    try:
+        if task not in tasks.TASKS:
+            raise ValueError('Task must be one of %s, %s was specified' % (sorted(tasks.TASKS), task))
+        # Relative paths are resolved as they would be by the service command
+        os.chdir(cwd)
+        output = tasks.TASKS[task](_dataset_cache, status_file=status_file, **args)
+        return {'output': output or '', 'error': None}
+    except Exception:
+        logger.exception('Task %s failed', task)
+        # Handles to files that may have been partially written are not kept
+        _dataset_cache.clear()
+        return {'output': '', 'error': traceback.format_exc()}
+
+
+def worker_loop(conn, cache_size, gdal_cache_mb):
+    """Worker process main loop: run the tasks received on conn, and send their results."""
+    init_worker(cache_size, gdal_cache_mb)
+    while True:
+        try:
+            task_args = conn.recv()
+        except EOFError:
+            break
+        conn.send(run_task(*task_args))
+
+
+class Worker(object):
+    """A long-lived worker process, and the connection used to send it tasks."""
+
+    def __init__(self, initargs):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_loop, args=(child_conn,) + tuple(initargs))
+        self.process.daemon = True
+        self.process.start()
+        # Only the worker holds its end, so that the connection reports EOF if the worker dies
+        child_conn.close()
+
+
+class WorkerPool(object):
+    """
+    Pool of long-lived worker processes, each running one task at a time.
+
+    Unlike multiprocessing.Pool, the process running each task is known, so a worker that dies,
+    e.g. from a segfault or the OOM killer, is detected as soon as it exits and is replaced,
+    without limiting how long a valid task may run.
+    """
+
+    def __init__(self, processes, initargs):
+        self._initargs = initargs
+        self._workers = [Worker(initargs) for _ in range(processes or multiprocessing.cpu_count())]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def run(self, task_args):
+        """
+        Run a task in the next idle worker.
+
+        Returns
+        -------
+        dict
+            The task output, and error message or None.
+        """
+        worker = self._idle.get()
+        try:
+            worker.conn.send(task_args)
+            while worker.process.is_alive() or worker.conn.poll():
+                if worker.conn.poll(POLL_INTERVAL):
+                    try:
+                        return worker.conn.recv()
+                    except EOFError:
+                        break
+
+            worker.process.join()
+            exitcode = worker.process.exitcode
+            logger.error('Worker %d died running task %s, exit code %s', worker.process.pid, task_args[0], exitcode)
+            self._workers.remove(worker)
+            worker = Worker(self._initargs)
+            self._workers.append(worker)
+            if exitcode is not None and exitcode < 0:
+                reason = 'killed by signal %d' % -exitcode
+            else:
+                reason = 'exited with code %s' % exitcode
+            return {'output': '', 'error': 'Worker process running task %s %s' % (task_args[0], reason)}
+        finally:
+            self._idle.put(worker)
+
+    def terminate(self):
+        for worker in self._workers:
+            worker.process.terminate()
+
+
+class TaskHandler(socketserver.StreamRequestHandler):
+    """Reads a task request line from the client, and writes the task result."""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            task_args = (request['task'], request['args'], request['cwd'], request.get('status_file'))
+        except (ValueError, KeyError, TypeError) as e:
+            result = {'output': '', 'error': 'Malformed task request: %s' % e}
+        else:
+            logger.info('Task %s: %s', request['task'], request['args'])
+            result = self.server.pool.run(task_args)
+        self.wfile.write(json.dumps(result).encode('utf-8'))
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server submitting task requests to the worker pool."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool):
+        self.pool = pool
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, TaskHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent worker runtime for EO4A service commands')
+    parser.add_argument('--socket', default=worker_socket(),
+                        help='Unix socket path (default=$%s)' % WORKER_SOCKET_ENV)
+    parser.add_argument('--processes', type=int, help='Number of worker processes (default=number of CPUs)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help='Number of open datasets cached by each worker (default=%d)' % DEFAULT_CACHE_SIZE)
+    parser.add_argument('--gdal-cache', type=int, default=DEFAULT_GDAL_CACHE_MB,
+                        help='GDAL block cache size per worker in MB (default=%d)' % DEFAULT_GDAL_CACHE_MB)
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error('--socket or %s must be specified' % WORKER_SOCKET_ENV)
+
+    logging.basicConfig(level=logging.INFO)
+    pool = WorkerPool(args.processes, (args.cache_size, args.gdal_cache))
+    server = WorkerServer(args.socket, pool)
+    logger.info('Worker runtime listening on %s', args.socket)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        pool.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Service tasks run by the persistent worker runtime.
+
+Each task matches a service command (GDAL tool or service script), using the GDAL Python API
+and the worker's dataset cache instead of separate processes. Tasks are called with the dataset
+cache, the service status file (if any) and the arguments submitted by the client, and return
+any output that the service command would have written to stdout.
+"""
+import glob
+import os
+import re
+import shlex
+import zipfile
+
+from osgeo import gdal
+
+from sentinel import windowed
+
+__author__ = "Derek O'Callaghan"
+
+
+def write_status(status_file, progress, message):
+    """Report progress in the service status file, if any: <percentage> <message>"""
+    if status_file:
+        with open(status_file, 'w') as sf:
+            sf.write('%d %s\n' % (progress, message))
+
+
+def gdalinfo(cache, datasetname, options='', status_file=None):
+    """
+    gdalinfo, with the same options string as the GdalInfo service command.
+
+    As -sd and -oo are only handled by the gdalinfo binary, the subdataset is resolved and opened
+    here, with any open options.
+    """
+    info_options = []
+    open_options = []
+    subdataset = None
+    args = shlex.split(options)
+    i = 0
+    while i < len(args):
+        if args[i] in ['-sd', '-oo'] and i + 1 < len(args):
+            if args[i] == '-sd':
+                subdataset = int(args[i + 1])
+            else:
+                open_options.append(args[i + 1])
+            i += 2
+        else:
+            info_options.append(args[i])
+            i += 1
+
+    dataset = cache.open(datasetname, open_options=open_options)
+    if subdataset is not None:
+        name = (dataset.GetMetadata('SUBDATASETS') or {}).get('SUBDATASET_%d_NAME' % subdataset)
+        if not name:
+            raise ValueError('Subdataset %d not found in %s' % (subdataset, datasetname))
+        dataset = cache.open(name, open_options=open_options)
+    # Return the report as written by gdalinfo, rather than a dict for -json
+    output = gdal.Info(dataset, options=info_options, deserialize=False)
+    # Write any statistics/histograms computed for -stats/-hist to the .aux.xml file now, as
+    # gdalinfo does when it closes the dataset, rather than when the cached handle is closed
+    dataset.FlushCache()
+    return output
+
+
+def gdalwarp(cache, srcfile, dstfile, options='', status_file=None):
+    """
+    gdalwarp, with the same options string as the GdalWarp service command.
+
+    As with gdalwarp, an existing destination file is updated unless -overwrite is specified.
+    """
+    src = cache.open(srcfile)
+    with cache.writing(dstfile):
+        if os.path.exists(dstfile) and '-overwrite' not in options.split():
+            dst = gdal.Open(dstfile, gdal.GA_Update)
+        else:
+            dst = dstfile
+        gdal.Warp(dst, src, options=options)
+        dst = None
+
+
+def _s2_products(s2_product_dir):
+    products = sorted(glob.glob(os.path.join(os.path.abspath(s2_product_dir), '*.zip')))
+    if not products:
+        raise ValueError('No products have been found in %s' % s2_product_dir)
+    return products
+
+
+def _s2_band_raster(product, resolution, band):
+    """
+    Get the /vsizip/ path of a band raster in a product archive, avoiding unzipping the product.
+
+    As in the service scripts, the raster at the requested resolution is used if available,
+    otherwise the band's native resolution raster.
+    """
+    with zipfile.ZipFile(product) as zf:
+        names = sorted(zf.namelist())
+    for pattern in ['.*%s.*B%s.*jp2$' % (resolution, band), '.*B%s.*jp2$' % band]:
+        matches = [name for name in names if re.match(pattern, name)]
+        if matches:
+            return '/vsizip/%s/%s' % (product, matches[0])
+    raise ValueError('Required band %s raster is not found in %s archive' % (band, product))
+
+
+def _s2_process(cache, s2_product_dir, output_dir, resolution, bands, output_name, calc, num_bands,
+                data_type=None, creation_options=None, status_file=None):
+    """Process each Sentinel-2 product in a directory, matching the service scripts."""
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    products = _s2_products(s2_product_dir)
+    for i, product in enumerate(products):
+        write_status(status_file, (i + 1) * 90 // len(products), 'Processing %d/%d' % (i + 1, len(products)))
+        rasters = [_s2_band_raster(product, resolution, band) for band in bands]
+        outfile = os.path.join(output_dir, output_name % os.path.basename(product).split('.')[0])
+        with cache.writing(outfile):
+            windowed.process(rasters, int(resolution.strip('Rm')), outfile, calc, num_bands,
+                             data_type or cache.open(rasters[0]).GetRasterBand(1).DataType,
+                             creation_options=creation_options, open_raster=cache.open)
+
+
+def sentinel2_ndvi(cache, s2_product_dir, nir_band, red_band, resolution, output_dir, status_file=None):
+    """sentinel2ndvi service script, resolution e.g. R60m."""
+    if nir_band == red_band:
+        raise ValueError('Different bands must be specified (%s = %s)' % (nir_band, red_band))
+    _s2_process(cache, s2_product_dir, output_dir, resolution, [nir_band, red_band],
+                'ndvi_%s_%s_%s_%%s.tif' % (nir_band, red_band, resolution),
+                windowed.ndvi, 1, data_type=gdal.GDT_Float32, status_file=status_file)
+
+
+def sentinel2_rgb(cache, s2_product_dir, r_band, g_band, b_band, resolution, output_dir, status_file=None):
+    """sentinel2rgb service script, resolution e.g. R60m."""
+    _s2_process(cache, s2_product_dir, output_dir, resolution, [r_band, g_band, b_band],
+                'R%s_G%s_B%s_%%s.tif' % (r_band, g_band, b_band),
+                windowed.rgb, 3, creation_options=['PHOTOMETRIC=RGB'], status_file=status_file)
+
+
+def merge_shapefiles(cache, input_dir, output_dir, filename, status_file=None):
+    """merge_shapefiles.sh service script."""
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    outfile = os.path.join(output_dir, filename + '.shp')
+    with cache.writing(outfile):
+        driver = gdal.GetDriverByName('ESRI Shapefile')
+        if os.path.exists(outfile):
+            driver.Delete(outfile)
+
+        for infile in sorted(glob.glob(os.path.join(input_dir, '*.shp'))):
+            if not os.path.exists(outfile):
+                gdal.VectorTranslate(outfile, cache.open(infile, gdal.OF_VECTOR), format='ESRI Shapefile')
+            else:
+                gdal.VectorTranslate(outfile, cache.open(infile, gdal.OF_VECTOR), format='ESRI Shapefile',
+                                     accessMode='append')
+
+
+# Task name, matching the client worker_command() task argument, to task function
+TASKS = {
+    'gdalinfo': gdalinfo,
+    'gdalwarp': gdalwarp,
+    'sentinel2-ndvi': sentinel2_ndvi,
+    'sentinel2-rgb': sentinel2_rgb,
+    'merge_shapefiles': merge_shapefiles,
+}